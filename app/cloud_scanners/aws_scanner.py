@@ -1,202 +1,308 @@
 import boto3
-from typing import Dict, List, Optional, Set
+from botocore.config import Config
+from typing import Dict, Iterator, List, Optional
 import logging
+import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 
+# Resource types collected for each regional service. Each resource type is
+# scanned by the matching AWSScanner._scan_<resource_type> method.
+SERVICE_RESOURCES = {
+    'ec2': ('ec2_instances', 'vpcs', 'security_groups'),
+    'elb': ('load_balancers',),
+    'eks': ('eks_clusters',),
+    'dynamodb': ('dynamodb_tables',),
+    'elasticache': ('elasticache_clusters',),
+    'logs': ('cloudwatch_logs',),
+    'rds': ('rds_instances',),
+    'lambda': ('lambda_functions',)
+}
+
+# Terminated instances linger in describe_instances for about an hour; filter
+# them out server-side rather than transferring and parsing them
+LIVE_INSTANCE_STATES = ['pending', 'running', 'stopping', 'stopped']
+
+# Resource types collected once per account rather than per region
+GLOBAL_SERVICE_RESOURCES = {
+    's3': ('s3_buckets',)
+}
+
+# Base cache TTL per resource type: volatile state expires quickly, while
+# rarely changing network topology is kept much longer
+RESOURCE_TTLS = {
+    'ec2_instances': timedelta(minutes=2),
+    'vpcs': timedelta(hours=6),
+    'security_groups': timedelta(hours=1),
+    'load_balancers': timedelta(minutes=30),
+    'eks_clusters': timedelta(hours=1),
+    'dynamodb_tables': timedelta(hours=1),
+    'elasticache_clusters': timedelta(minutes=30),
+    'cloudwatch_logs': timedelta(hours=1),
+    'rds_instances': timedelta(minutes=5),
+    'lambda_functions': timedelta(minutes=15),
+    's3_buckets': timedelta(minutes=30)
+}
+
+# Upper bound on how far an unchanged entry's TTL can grow past its base TTL
+MAX_TTL_MULTIPLIER = 4
+
+# Scans are network-bound, so use far more threads than cores
+MAX_SCAN_WORKERS = 32
+
+# Shared by every client: a pool sized so scan workers reuse warm connections
+# instead of repeating TLS handshakes, adaptive retries to back off under
+# throttling, and short connect timeouts so an unreachable region fails fast
+CLIENT_CONFIG = Config(
+    max_pool_connections=64,
+    retries={'max_attempts': 3, 'mode': 'adaptive'},
+    connect_timeout=3,
+    read_timeout=15,
+    tcp_keepalive=True
+)
+
+# Regions enabled by default in every account, used if describe_regions fails
+DEFAULT_REGIONS = (
+    'us-east-1', 'us-east-2', 'us-west-1', 'us-west-2',
+    'ca-central-1', 'sa-east-1',
+    'eu-central-1', 'eu-west-1', 'eu-west-2', 'eu-west-3', 'eu-north-1',
+    'ap-south-1', 'ap-northeast-1', 'ap-northeast-2', 'ap-northeast-3',
+    'ap-southeast-1', 'ap-southeast-2'
+)
+
+# Enabled regions rarely change, so look them up once a week per credentials
+# profile and share the result between scanner instances
+REGIONS_TTL = timedelta(days=7)
+_regions_cache = {}  # {profile_name: (regions, timestamp)}
+_regions_lock = threading.Lock()
+
+def _fetch_regions(session: boto3.Session) -> List[str]:
+    """Get the account's enabled regions, cached process-wide for REGIONS_TTL."""
+    with _regions_lock:
+        entry = _regions_cache.get(session.profile_name)
+    if entry and datetime.now() - entry[1] < REGIONS_TTL:
+        return list(entry[0])
+
+    try:
+        ec2 = session.client('ec2', region_name=session.region_name or 'us-east-1', config=CLIENT_CONFIG)
+        regions = tuple(region['RegionName'] for region in ec2.describe_regions()['Regions'])
+    except Exception as e:
+        logging.warning(f"Error listing AWS regions, using fallback list: {str(e)}")
+        return list(entry[0] if entry else DEFAULT_REGIONS)
+
+    with _regions_lock:
+        _regions_cache[session.profile_name] = (regions, datetime.now())
+    return list(regions)
+
+def _tags_to_dict(tags: Optional[List[Dict]]) -> Dict[str, str]:
+    """Convert AWS's [{'Key': k, 'Value': v}] tag list into a {k: v} dict."""
+    return {tag['Key']: tag['Value'] for tag in tags or []}
+
+def _paginate(client, operation: str, result_key: str, page_size: Optional[int] = None, **kwargs):
+    """Iterate over the items of every page returned by a paginated AWS API call."""
+    pagination_config = {'PageSize': page_size} if page_size else {}
+    paginator = client.get_paginator(operation)
+    for page in paginator.paginate(PaginationConfig=pagination_config, **kwargs):
+        yield from page.get(result_key, [])
+
 class AWSScanner:
     def __init__(self):
         self.session = boto3.Session()
+        self._clients = {}
+        self._clients_lock = threading.Lock()  # boto3 Sessions are not thread-safe
         self.regions = self._get_available_regions()
-        self.cache = {}
-        self.cache_ttl = timedelta(minutes=15)  # 15 minutes cache TTL
+        self.cache = {}  # {resource_type: {region: (data, timestamp, ttl)}}
+        self._cache_lock = threading.Lock()  # Guards cache reads and read-modify-writes
+        self.cache_ttl = timedelta(minutes=15)  # Default TTL for types missing from RESOURCE_TTLS
         
+    def _client(self, service: str, region: Optional[str] = None):
+        """Get a cached client for a service in a region, creating it on first use."""
+        key = (service, region)
+        client = self._clients.get(key)
+        if client is None:
+            with self._clients_lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = self.session.client(service, region_name=region, config=CLIENT_CONFIG)
+                    self._clients[key] = client
+        return client
+
     def _get_available_regions(self) -> List[str]:
         """Get list of all available AWS regions."""
-        ec2 = boto3.client('ec2')
-        return [region['RegionName'] for region in ec2.describe_regions()['Regions']]
+        return _fetch_regions(self.session)
     
-    def scan_region(self, region: str, services: Set[str]) -> Dict:
-        """Scan specific services in a single region."""
-        result = {}
-        
-        # Initialize AWS clients
-        clients = {}
-        try:
-            clients = {
-                'ec2': boto3.client('ec2', region_name=region),
-                'rds': boto3.client('rds', region_name=region),
-                'cloudwatch': boto3.client('cloudwatch', region_name=region),
-                'logs': boto3.client('logs', region_name=region),
-                'lambda': boto3.client('lambda', region_name=region),
-                'iam': boto3.client('iam', region_name=region),
-                'dynamodb': boto3.client('dynamodb', region_name=region),
-                'elasticache': boto3.client('elasticache', region_name=region),
-                'elb': boto3.client('elbv2', region_name=region),
-                'eks': boto3.client('eks', region_name=region)
+    def _scan_ec2_instances(self, region: str) -> Iterator[Dict]:
+        return (
+            {
+                'instance_id': instance['InstanceId'],
+                'instance_type': instance['InstanceType'],
+                'state': instance['State']['Name'],
+                'region': region,
+                'tags': _tags_to_dict(instance.get('Tags'))
             }
-        except Exception as e:
-            logging.error(f"Error initializing AWS clients in region {region}: {str(e)}")
-            return result
-        try:
-            # EC2 Resources
-            if 'ec2' in services:
-                instances = clients['ec2'].describe_instances()
-                result['ec2_instances'] = [
-                    {
-                        'instance_id': instance['InstanceId'],
-                        'instance_type': instance['InstanceType'],
-                        'state': instance['State']['Name'],
-                        'region': region,
-                        'tags': instance.get('Tags', [])
-                    }
-                    for reservation in instances['Reservations']
-                    for instance in reservation['Instances']
-                ]
-                
-                # VPCs and Subnets
-                vpcs = clients['ec2'].describe_vpcs()
-                result['vpcs'] = [
-                    {
-                        'vpc_id': vpc['VpcId'],
-                        'cidr_block': vpc['CidrBlock'],
-                        'region': region,
-                        'tags': vpc.get('Tags', [])
-                    }
-                    for vpc in vpcs['Vpcs']
-                ]
-                
-                # Security Groups
-                security_groups = clients['ec2'].describe_security_groups()
-                result['security_groups'] = [
-                    {
-                        'group_id': sg['GroupId'],
-                        'group_name': sg['GroupName'],
-                        'description': sg['Description'],
-                        'vpc_id': sg.get('VpcId'),
-                        'region': region
-                    }
-                    for sg in security_groups['SecurityGroups']
-                ]
-
-            # Load Balancers
-            if 'elb' in services:
-                try:
-                    lbs = clients['elb'].describe_load_balancers()
-                    result['load_balancers'] = [
-                        {
-                            'arn': lb['LoadBalancerArn'],
-                            'name': lb['LoadBalancerName'],
-                            'type': lb['Type'],
-                            'state': lb['State']['Code'],
-                            'dns_name': lb['DNSName'],
-                            'region': region
-                        }
-                        for lb in lbs['LoadBalancers']
-                    ]
-                except Exception as e:
-                    logging.warning(f"Error scanning ELB in region {region}: {str(e)}")
-                    result['load_balancers'] = []
-
-            # EKS Clusters
-            if 'eks' in services:
-                try:
-                    clusters = clients['eks'].list_clusters()
-                    result['eks_clusters'] = [
-                        {
-                            'name': cluster_name,
-                            'region': region
-                        }
-                        for cluster_name in clusters['clusters']
-                    ]
-                except Exception as e:
-                    logging.warning(f"Error scanning EKS in region {region}: {str(e)}")
-                    result['eks_clusters'] = []
-
-            # DynamoDB Tables
-            if 'dynamodb' in services:
-                try:
-                    tables = clients['dynamodb'].list_tables()
-                    result['dynamodb_tables'] = [
-                        {
-                            'name': table_name,
-                            'region': region
-                        }
-                        for table_name in tables['TableNames']
-                    ]
-                except Exception as e:
-                    logging.warning(f"Error scanning DynamoDB in region {region}: {str(e)}")
-                    result['dynamodb_tables'] = []
-
-            # ElastiCache Clusters
-            if 'elasticache' in services:
-                try:
-                    clusters = clients['elasticache'].describe_cache_clusters()
-                    result['elasticache_clusters'] = [
-                        {
-                            'cluster_id': cluster['CacheClusterId'],
-                            'engine': cluster['Engine'],
-                            'status': cluster['CacheClusterStatus'],
-                            'region': region
-                        }
-                        for cluster in clusters['CacheClusters']
-                    ]
-                except Exception as e:
-                    logging.warning(f"Error scanning ElastiCache in region {region}: {str(e)}")
-                    result['elasticache_clusters'] = []
-
-            if 'logs' in services:
-                logs = boto3.client('logs', region_name=region)
-                log_groups = logs.describe_log_groups()
-                result['cloudwatch_logs'] = [
-                    {
-                        'name': group['logGroupName'],
-                        'retention_days': group.get('retentionInDays'),
-                        'stored_bytes': group.get('storedBytes'),
-                        'region': region
-                    }
-                    for group in log_groups['logGroups']
-                ]
-
-            if 'rds' in services:
-                rds = boto3.client('rds', region_name=region)
-                db_instances = rds.describe_db_instances()
-                result['rds_instances'] = [
-                    {
-                        'db_identifier': db['DBInstanceIdentifier'],
-                        'engine': db['Engine'],
-                        'status': db['DBInstanceStatus'],
-                        'region': region
-                    }
-                    for db in db_instances['DBInstances']
-                ]
-
-            if 'lambda' in services:
-                lambda_client = boto3.client('lambda', region_name=region)
-                functions = lambda_client.list_functions()
-                result['lambda_functions'] = [
-                    {
-                        'function_name': func['FunctionName'],
-                        'runtime': func['Runtime'],
-                        'region': region
-                    }
-                    for func in functions['Functions']
-                ]
+            for reservation in _paginate(
+                self._client('ec2', region), 'describe_instances', 'Reservations', page_size=1000,
+                Filters=[{'Name': 'instance-state-name', 'Values': LIVE_INSTANCE_STATES}]
+            )
+            for instance in reservation['Instances']
+        )
+
+    def _scan_vpcs(self, region: str) -> Iterator[Dict]:
+        return (
+            {
+                'vpc_id': vpc['VpcId'],
+                'cidr_block': vpc['CidrBlock'],
+                'region': region,
+                'tags': _tags_to_dict(vpc.get('Tags'))
+            }
+            for vpc in _paginate(self._client('ec2', region), 'describe_vpcs', 'Vpcs', page_size=1000)
+        )
 
+    def _scan_security_groups(self, region: str) -> Iterator[Dict]:
+        return (
+            {
+                'group_id': sg['GroupId'],
+                'group_name': sg['GroupName'],
+                'description': sg['Description'],
+                'vpc_id': sg.get('VpcId'),
+                'region': region,
+                'tags': _tags_to_dict(sg.get('Tags'))
+            }
+            for sg in _paginate(self._client('ec2', region), 'describe_security_groups', 'SecurityGroups', page_size=1000)
+        )
+
+    def _scan_load_balancers(self, region: str) -> Iterator[Dict]:
+        return (
+            {
+                'arn': lb['LoadBalancerArn'],
+                'name': lb['LoadBalancerName'],
+                'type': lb['Type'],
+                'state': lb['State']['Code'],
+                'dns_name': lb['DNSName'],
+                'region': region
+            }
+            for lb in _paginate(self._client('elbv2', region), 'describe_load_balancers', 'LoadBalancers', page_size=400)
+        )
+
+    def _scan_eks_clusters(self, region: str) -> Iterator[Dict]:
+        return (
+            {
+                'name': cluster_name,
+                'region': region
+            }
+            for cluster_name in _paginate(self._client('eks', region), 'list_clusters', 'clusters', page_size=100)
+        )
+
+    def _scan_dynamodb_tables(self, region: str) -> Iterator[Dict]:
+        return (
+            {
+                'name': table_name,
+                'region': region
+            }
+            for table_name in _paginate(self._client('dynamodb', region), 'list_tables', 'TableNames', page_size=100)
+        )
+
+    def _scan_elasticache_clusters(self, region: str) -> Iterator[Dict]:
+        return (
+            {
+                'cluster_id': cluster['CacheClusterId'],
+                'engine': cluster['Engine'],
+                'status': cluster['CacheClusterStatus'],
+                'region': region
+            }
+            for cluster in _paginate(self._client('elasticache', region), 'describe_cache_clusters', 'CacheClusters', page_size=100)
+        )
+
+    def _scan_cloudwatch_logs(self, region: str) -> Iterator[Dict]:
+        return (
+            {
+                'name': group['logGroupName'],
+                'retention_days': group.get('retentionInDays'),
+                'stored_bytes': group.get('storedBytes'),
+                'region': region
+            }
+            for group in _paginate(self._client('logs', region), 'describe_log_groups', 'logGroups', page_size=50)
+        )
+
+    def _scan_rds_instances(self, region: str) -> Iterator[Dict]:
+        return (
+            {
+                'db_identifier': db['DBInstanceIdentifier'],
+                'engine': db['Engine'],
+                'status': db['DBInstanceStatus'],
+                'region': region
+            }
+            for db in _paginate(self._client('rds', region), 'describe_db_instances', 'DBInstances', page_size=100)
+        )
+
+    def _scan_lambda_functions(self, region: str) -> Iterator[Dict]:
+        return (
+            {
+                'function_name': func['FunctionName'],
+                'runtime': func['Runtime'],
+                'region': region
+            }
+            for func in _paginate(self._client('lambda', region), 'list_functions', 'Functions', page_size=50)
+        )
+
+    def _scan_s3_buckets(self, region: Optional[str]) -> Iterator[Dict]:
+        # S3 is a global service, so this is scanned once with region None
+        return (
+            {
+                'name': bucket['Name'],
+                'creation_date': bucket['CreationDate'].isoformat()
+            }
+            for bucket in self._client('s3').list_buckets()['Buckets']
+        )
+
+    def _scan_resource(self, resource_type: str, region: Optional[str]) -> Optional[List[Dict]]:
+        """Scan a single resource type in a single region, returning None on failure.
+
+        The _scan_<resource_type> methods stream items page by page, so each
+        region's results are materialized exactly once, here.
+        """
+        try:
+            return list(getattr(self, f'_scan_{resource_type}')(region))
         except Exception as e:
-            logging.error(f"Error scanning region {region}: {str(e)}")
-            
-        return result
+            logging.warning(f"Error scanning {resource_type} in region {region}: {str(e)}")
+            return None
+
+    def _get_cache_entry(self, resource_type: str, region: Optional[str]) -> Optional[tuple]:
+        """Get the (data, timestamp, ttl) cache entry for a region, expired or not."""
+        with self._cache_lock:
+            return self.cache.get(resource_type, {}).get(region)
+
+    def _get_cached(self, resource_type: str, region: Optional[str]) -> Optional[List[Dict]]:
+        """Get cached resources for a region if the entry has not expired."""
+        entry = self._get_cache_entry(resource_type, region)
+        if entry:
+            data, timestamp, ttl = entry
+            if datetime.now() - timestamp < ttl:
+                return data
+        return None
+
+    def _store_cached(self, resource_type: str, region: Optional[str], data: List[Dict]):
+        """Cache resources for a region, adapting the TTL to how often they change.
+
+        Each refresh that finds the data unchanged doubles the entry's TTL, up
+        to MAX_TTL_MULTIPLIER times the resource type's base TTL. Any change
+        resets it to the base TTL.
+        """
+        base_ttl = RESOURCE_TTLS.get(resource_type, self.cache_ttl)
+        with self._cache_lock:
+            previous = self.cache.get(resource_type, {}).get(region)
+            if previous and previous[0] == data:
+                ttl = min(previous[2] * 2, base_ttl * MAX_TTL_MULTIPLIER)
+            else:
+                ttl = base_ttl
+            self.cache.setdefault(resource_type, {})[region] = (data, datetime.now(), ttl)
 
     def scan_resources(self, services: Optional[List[str]] = None) -> Dict:
-        """Scan all AWS resources across regions."""
-        # Use cache if available and not expired
-        cache_key = f"all_regions-{','.join(sorted(services or []))}"
-        if cache_key in self.cache:
-            cached_data, timestamp = self.cache[cache_key]
-            if datetime.now() - timestamp < self.cache_ttl:
-                return cached_data
+        """Scan all AWS resources across regions.
 
+        Results are cached per resource type and region, and only entries
+        whose TTL has expired are rescanned.
+        """
         infrastructure_data = {
             'ec2_instances': [],
             'vpcs': [],
@@ -219,36 +325,51 @@ class AWSScanner:
             'eks'        # Kubernetes clusters
         ])
         
+        # Every (region, resource type) pair to collect; global services use region None
+        tasks = []
+        for service in sorted(services_set):
+            for resource_type in GLOBAL_SERVICE_RESOURCES.get(service, ()):
+                tasks.append((None, resource_type))
+            for resource_type in SERVICE_RESOURCES.get(service, ()):
+                tasks.extend((region, resource_type) for region in self.regions)
+
+        results = {}
+        expired = []
+        for region, resource_type in tasks:
+            cached = self._get_cached(resource_type, region)
+            if cached is None:
+                expired.append((region, resource_type))
+            else:
+                results[(region, resource_type)] = cached
+
         try:
-            if 's3' in services_set:
-                # Scan S3 (Global service)
-                s3_client = boto3.client('s3')
-                buckets = s3_client.list_buckets()['Buckets']
-                infrastructure_data['s3_buckets'] = [
-                    {
-                        'name': bucket['Name'],
-                        'creation_date': bucket['CreationDate'].isoformat()
+            # Rescan expired pairs in parallel so the calls within a region
+            # overlap instead of running back to back
+            if expired:
+                with ThreadPoolExecutor(max_workers=min(len(expired), MAX_SCAN_WORKERS)) as executor:
+                    future_to_task = {
+                        executor.submit(self._scan_resource, resource_type, region): (region, resource_type)
+                        for region, resource_type in expired
                     }
-                    for bucket in buckets
-                ]
-            
-            # Scan regional resources in parallel
-            with ThreadPoolExecutor(max_workers=min(len(self.regions), 10)) as executor:
-                future_to_region = {executor.submit(self.scan_region, region, services_set): region for region in self.regions}
-                # Process completed futures
-                for future in as_completed(future_to_region):
-                    region = future_to_region[future]
-                    try:
-                        result = future.result()
-                        for service_type, resources in result.items():
-                            if service_type in infrastructure_data:
-                                infrastructure_data[service_type].extend(resources)
-                    except Exception as e:
-                        logging.error(f"Error processing results from region {region}: {str(e)}")
+                    # Process completed futures
+                    for future in as_completed(future_to_task):
+                        region, resource_type = future_to_task[future]
+                        try:
+                            data = future.result()
+                        except Exception as e:
+                            logging.error(f"Error processing {resource_type} results from region {region}: {str(e)}")
+                            data = None
+                        if data is None:
+                            # Fall back to the expired entry rather than reporting nothing
+                            entry = self._get_cache_entry(resource_type, region)
+                            results[(region, resource_type)] = entry[0] if entry else []
+                        else:
+                            self._store_cached(resource_type, region, data)
+                            results[(region, resource_type)] = data
 
         except Exception as e:
             logging.error(f"Error during AWS resource scanning: {str(e)}")
-            
-        # Cache the results
-        self.cache[cache_key] = (infrastructure_data, datetime.now())
+
+        for region, resource_type in tasks:
+            infrastructure_data.setdefault(resource_type, []).extend(results.get((region, resource_type), []))
         return infrastructure_data
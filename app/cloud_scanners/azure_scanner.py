@@ -8,16 +8,68 @@ from azure.mgmt.containerservice import ContainerServiceClient
 from azure.mgmt.web import WebSiteManagementClient
 from azure.mgmt.cosmosdb import CosmosDBManagementClient
 from azure.mgmt.sql import SqlManagementClient
+from cachetools import TTLCache
+from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import datetime, timedelta
+from datetime import timedelta
 from typing import Dict, List, Optional, Set
 import logging
+import threading
+
+# Resource types produced by each service scanned in scan_resource_group
+SERVICE_RESOURCES = {
+    'compute': ('virtual_machines',),
+    'network': ('virtual_networks', 'network_security_groups'),
+    'storage': ('storage_accounts',),
+    'web': ('web_apps',),
+    'container': ('aks_clusters',),
+    'cosmos': ('cosmos_db',),
+    'sql': ('sql_servers',)
+}
+
+# ARM resource types (lowercased) whose presence marks a resource group as active
+ACTIVE_RESOURCE_TYPES = {
+    'microsoft.compute/virtualmachines',
+    'microsoft.web/sites',
+    'microsoft.storage/storageaccounts',
+    'microsoft.containerservice/managedclusters',
+    'microsoft.documentdb/databaseaccounts',
+    'microsoft.sql/servers'
+}
+
+# Services whose output needs fields missing from the subscription-wide resource
+# listing (VM size, address space, app state, ...). These are scanned with
+# per-resource-group calls, only in groups that contain the given ARM type.
+DETAIL_RESOURCE_TYPES = {
+    'compute': 'microsoft.compute/virtualmachines',
+    'network': 'microsoft.network/virtualnetworks',
+    'web': 'microsoft.web/sites',
+    'container': 'microsoft.containerservice/managedclusters',
+    'sql': 'microsoft.sql/servers'
+}
+
+# (service, result key, ARM type) for resources built directly from the listing
+INVENTORY_RESOURCES = [
+    ('network', 'network_security_groups', 'microsoft.network/networksecuritygroups'),
+    ('storage', 'storage_accounts', 'microsoft.storage/storageaccounts'),
+    ('cosmos', 'cosmos_db', 'microsoft.documentdb/databaseaccounts')
+]
+
+# Scans are network-bound, so use far more threads than cores
+MAX_SCAN_WORKERS = 32
+
+# Per-resource-group limit for listing SQL databases of several servers at once
+MAX_SQL_WORKERS = 8
 
 class AzureScanner:
     def __init__(self):
         self.credential = DefaultAzureCredential()
-        self.cache = {}
+        self._clients = {}  # {(subscription_id, service): client}, reused across scans
+        self._clients_lock = threading.Lock()
         self.cache_ttl = timedelta(minutes=15)  # 15 minutes cache TTL
+        # {(subscription_id, service): data}; TTLCache drops expired entries itself
+        self.cache = TTLCache(maxsize=1024, ttl=self.cache_ttl.total_seconds())
+        self._cache_lock = threading.Lock()  # TTLCache is not thread-safe
         
     def _get_default_subscription(self) -> str:
         """Get the default subscription ID from Azure."""
@@ -34,13 +86,10 @@ class AzureScanner:
             raise
         
     def _init_clients(self, subscription_id: str, services: Set[str]) -> Dict:
-        """Initialize Azure clients only for requested services."""
-        clients = {
-            'resource': ResourceManagementClient(self.credential, subscription_id)
-        }
-        
+        """Get clients for the requested services, creating each on first use."""
         # Only initialize clients for requested services
         service_to_client = {
+            'resource': ResourceManagementClient,
             'compute': ComputeManagementClient,
             'network': NetworkManagementClient,
             'storage': StorageManagementClient,
@@ -51,33 +100,52 @@ class AzureScanner:
             'sql': SqlManagementClient
         }
         
-        for service in services:
-            if service in service_to_client:
-                clients[service] = service_to_client[service](self.credential, subscription_id)
+        clients = {}
+        with self._clients_lock:
+            for service in {'resource'} | set(services):
+                if service in service_to_client:
+                    key = (subscription_id, service)
+                    if key not in self._clients:
+                        self._clients[key] = service_to_client[service](self.credential, subscription_id)
+                    clients[service] = self._clients[key]
                 
         return clients
         
-    def _get_active_resource_groups(self, resource_client) -> List[str]:
+    def _get_resource_inventory(self, resource_client) -> Dict[str, Dict[str, List]]:
+        """List every resource in the subscription once, grouped by ARM type and resource group."""
+        inventory = defaultdict(lambda: defaultdict(list))
+        for resource in resource_client.resources.list():
+            resource_group = resource.id.split('/')[4]  # Extract resource group name from resource ID
+            inventory[resource.type.lower()][resource_group].append(resource)
+        return inventory
+
+    def _get_active_resource_groups(self, inventory: Dict[str, Dict[str, List]]) -> List[str]:
         """Get list of resource groups that have active resources."""
         active_groups = set()
-        
-        # Get all resources in the subscription
-        resources = resource_client.resources.list()
-        for resource in resources:
-            if resource.type in [
-                'Microsoft.Compute/virtualMachines',
-                'Microsoft.Web/sites',
-                'Microsoft.Storage/storageAccounts',
-                'Microsoft.ContainerService/managedClusters',
-                'Microsoft.DocumentDB/databaseAccounts',
-                'Microsoft.Sql/servers'
-            ]:
-                active_groups.add(resource.id.split('/')[4])  # Extract resource group name from resource ID
-                
+        for resource_type in ACTIVE_RESOURCE_TYPES:
+            active_groups.update(inventory.get(resource_type, {}))
         return list(active_groups)
-        
+
+    def _project_inventory_resource(self, result_key: str, resource, resource_group: str) -> Dict:
+        """Build a scan entry from a generic resource returned by the resource listing."""
+        entry = {
+            'name': resource.name,
+            'location': resource.location
+        }
+        if result_key == 'storage_accounts':
+            entry['sku'] = resource.sku.name if resource.sku else None
+        if result_key in ('storage_accounts', 'cosmos_db'):
+            entry['kind'] = resource.kind
+        entry['resource_group'] = resource_group
+        entry['tags'] = resource.tags
+        return entry
+
     def scan_resource_group(self, resource_group: str, clients: Dict, services: Set[str]) -> Dict:
-        """Scan resources in a specific resource group."""
+        """Scan resources in a specific resource group.
+
+        Only covers services listed in DETAIL_RESOURCE_TYPES; the rest are
+        built from the subscription-wide resource listing in scan_resources.
+        """
         result = {}
         
         try:
@@ -107,32 +175,7 @@ class AzureScanner:
                         'tags': vnet.tags
                     } for vnet in vnets
                 ]
-                
-                # Network Security Groups
-                nsgs = clients['network'].network_security_groups.list(resource_group)
-                result['network_security_groups'] = [
-                    {
-                        'name': nsg.name,
-                        'location': nsg.location,
-                        'resource_group': resource_group,
-                        'tags': nsg.tags
-                    } for nsg in nsgs
-                ]
-            
-            # Storage Accounts
-            if 'storage' in services:
-                storage_accounts = clients['storage'].storage_accounts.list_by_resource_group(resource_group)
-                result['storage_accounts'] = [
-                    {
-                        'name': storage.name,
-                        'location': storage.location,
-                        'sku': storage.sku.name,
-                        'kind': storage.kind,
-                        'resource_group': resource_group,
-                        'tags': storage.tags
-                    } for storage in storage_accounts
-                ]
-            
+
             # App Services
             if 'web' in services:
                 try:
@@ -167,44 +210,33 @@ class AzureScanner:
                     logging.warning(f"Error scanning AKS clusters in {resource_group}: {str(e)}")
                     result['aks_clusters'] = []
             
-            # Cosmos DB
-            if 'cosmos' in services:
-                try:
-                    accounts = clients['cosmos'].database_accounts.list_by_resource_group(resource_group)
-                    result['cosmos_db'] = [
-                        {
-                            'name': account.name,
-                            'location': account.location,
-                            'kind': account.kind,
-                            'resource_group': resource_group,
-                            'tags': account.tags
-                        } for account in accounts
-                    ]
-                except Exception as e:
-                    logging.warning(f"Error scanning Cosmos DB in {resource_group}: {str(e)}")
-                    result['cosmos_db'] = []
-            
             # SQL Databases
             if 'sql' in services:
                 try:
-                    servers = clients['sql'].servers.list_by_resource_group(resource_group)
+                    servers = list(clients['sql'].servers.list_by_resource_group(resource_group))
                     result['sql_servers'] = []
-                    for server in servers:
-                        databases = clients['sql'].databases.list_by_server(resource_group, server.name)
-                        result['sql_servers'].append({
-                            'name': server.name,
-                            'location': server.location,
-                            'version': server.version,
-                            'resource_group': resource_group,
-                            'databases': [
-                                {
-                                    'name': db.name,
-                                    'status': db.status,
-                                    'max_size_bytes': db.max_size_bytes
-                                } for db in databases
-                            ],
-                            'tags': server.tags
-                        })
+                    if servers:
+                        # List each server's databases in parallel rather than one REST call after another
+                        with ThreadPoolExecutor(max_workers=min(len(servers), MAX_SQL_WORKERS)) as executor:
+                            server_databases = executor.map(
+                                lambda server: list(clients['sql'].databases.list_by_server(resource_group, server.name)),
+                                servers
+                            )
+                            for server, databases in zip(servers, server_databases):
+                                result['sql_servers'].append({
+                                    'name': server.name,
+                                    'location': server.location,
+                                    'version': server.version,
+                                    'resource_group': resource_group,
+                                    'databases': [
+                                        {
+                                            'name': db.name,
+                                            'status': db.status,
+                                            'max_size_bytes': db.max_size_bytes
+                                        } for db in databases
+                                    ],
+                                    'tags': server.tags
+                                })
                 except Exception as e:
                     logging.warning(f"Error scanning SQL servers in {resource_group}: {str(e)}")
                     result['sql_servers'] = []
@@ -214,27 +246,29 @@ class AzureScanner:
             
         return result
         
+    def _get_cached(self, subscription_id: str, service: str) -> Optional[Dict]:
+        """Get the cached results of one service in a subscription if not expired."""
+        with self._cache_lock:
+            return self.cache.get((subscription_id, service))
+
     def scan_resources(self, subscription_id: Optional[str] = None, services: Optional[List[str]] = None) -> Dict:
         """Scan all Azure resources in the subscription.
+
+        Results are cached per (subscription, service), so a request for a
+        subset of previously scanned services is served from the cache and
+        only services without a fresh entry are rescanned.
+
         Args:
             subscription_id: Optional Azure subscription ID. If not provided, uses default subscription.
             services: Optional list of services to scan. If not provided, scans all supported services.
         Returns:
             Dict containing scanned resources.
         """
-        """Scan all Azure resources in the subscription."""
         # Get default subscription if none provided
         if subscription_id is None:
             subscription_id = self._get_default_subscription()
             logging.info(f"Using default subscription: {subscription_id}")
 
-        # Use cache if available and not expired
-        cache_key = f"{subscription_id}-{','.join(sorted(services or []))}"
-        if cache_key in self.cache:
-            cached_data, timestamp = self.cache[cache_key]
-            if datetime.now() - timestamp < self.cache_ttl:
-                return cached_data
-                
         # Convert services to set and add dependencies
         services_set = set(services or [
             'compute',    # Virtual Machines
@@ -248,7 +282,88 @@ class AzureScanner:
         # Add network service if compute is requested (for NSGs)
         if 'compute' in services_set:
             services_set.add('network')
+
+        service_data = {service: self._get_cached(subscription_id, service) for service in services_set}
+        missing = {service for service, data in service_data.items() if data is None}
+        resource_group_data = self._get_cached(subscription_id, 'resource_groups')
+
+        if missing or resource_group_data is None:
+            try:
+                # Initialize only clients for services that need per-group detail calls
+                detail_services = missing & DETAIL_RESOURCE_TYPES.keys()
+                clients = self._init_clients(subscription_id, detail_services)
+
+                # One paginated sweep over every resource in the subscription
+                inventory = self._get_resource_inventory(clients['resource'])
+                
+                # Get only active resource groups
+                resource_groups = self._get_active_resource_groups(inventory)
+                
+                # Store active resource group info, fetched with a single paginated
+                # list instead of one GET per group. Resource IDs do not always
+                # match the group's name casing, so match case-insensitively.
+                all_groups = {rg.name.lower(): rg for rg in clients['resource'].resource_groups.list()}
+                resource_group_data = {'resource_groups': [
+                    {
+                        'name': rg.name,
+                        'location': rg.location,
+                        'tags': rg.tags
+                    }
+                    for rg in (all_groups.get(rg_name.lower()) for rg_name in resource_groups)
+                    if rg is not None
+                ]}
+
+                scanned = {
+                    service: {resource_type: [] for resource_type in SERVICE_RESOURCES.get(service, ())}
+                    for service in missing
+                }
+                resource_type_to_service = {
+                    resource_type: service
+                    for service in missing
+                    for resource_type in SERVICE_RESOURCES.get(service, ())
+                }
+
+                # Resources whose reported fields are all in the listing need no further calls
+                for service, result_key, arm_type in INVENTORY_RESOURCES:
+                    if service in missing:
+                        for rg, resources in inventory.get(arm_type, {}).items():
+                            scanned[service][result_key].extend(
+                                self._project_inventory_resource(result_key, resource, rg) for resource in resources
+                            )
+
+                # Only call detail APIs for resource groups that contain that resource type
+                rg_services = defaultdict(set)
+                for service in detail_services:
+                    for rg in inventory.get(DETAIL_RESOURCE_TYPES[service], {}):
+                        rg_services[rg].add(service)
                 
+                # Scan resource groups in parallel
+                if rg_services:
+                    with ThreadPoolExecutor(max_workers=min(len(rg_services), MAX_SCAN_WORKERS)) as executor:
+                        future_to_rg = {executor.submit(self.scan_resource_group, rg, clients, rg_service_set): rg 
+                                       for rg, rg_service_set in rg_services.items()}
+                        
+                        # Process completed futures
+                        for future in as_completed(future_to_rg):
+                            rg = future_to_rg[future]
+                            try:
+                                result = future.result()
+                                for service_type, resources in result.items():
+                                    if service_type in resource_type_to_service:
+                                        scanned[resource_type_to_service[service_type]][service_type].extend(resources)
+                            except Exception as e:
+                                logging.error(f"Error processing results from resource group {rg}: {str(e)}")
+
+                # Cache the results
+                with self._cache_lock:
+                    self.cache[(subscription_id, 'resource_groups')] = resource_group_data
+                    for service, data in scanned.items():
+                        self.cache[(subscription_id, service)] = data
+                service_data.update(scanned)
+                    
+            except Exception as e:
+                logging.error(f"Error during Azure resource scanning: {str(e)}")
+            
         infrastructure_data = {
             'virtual_machines': [],
             'virtual_networks': [],
@@ -260,44 +375,7 @@ class AzureScanner:
             'sql_servers': [],
             'resource_groups': []
         }
-        
-        try:
-            # Initialize only needed clients
-            clients = self._init_clients(subscription_id, services_set)
-            
-            # Get only active resource groups
-            resource_groups = self._get_active_resource_groups(clients['resource'])
-            
-            # Store active resource group info
-            for rg_name in resource_groups:
-                rg = clients['resource'].resource_groups.get(rg_name)
-                infrastructure_data['resource_groups'].append({
-                    'name': rg.name,
-                    'location': rg.location,
-                    'tags': rg.tags
-                })
-            
-            # Scan resource groups in parallel
-            with ThreadPoolExecutor(max_workers=min(len(resource_groups), 10)) as executor:
-                future_to_rg = {executor.submit(self.scan_resource_group, rg, clients, services_set): rg 
-                               for rg in resource_groups}
-                
-                # Process completed futures
-                for future in as_completed(future_to_rg):
-                    rg = future_to_rg[future]
-                    try:
-                        result = future.result()
-                        for service_type, resources in result.items():
-                            if service_type in infrastructure_data:
-                                infrastructure_data[service_type].extend(resources)
-                    except Exception as e:
-                        logging.error(f"Error processing results from resource group {rg}: {str(e)}")
-
-
-                    
-        except Exception as e:
-            logging.error(f"Error during Azure resource scanning: {str(e)}")
-            
-        # Cache the results
-        self.cache[cache_key] = (infrastructure_data, datetime.now())
+        for data in list(service_data.values()) + [resource_group_data]:
+            for service_type, resources in (data or {}).items():
+                infrastructure_data[service_type].extend(resources)
         return infrastructure_data
@@ -1,41 +1,180 @@
-from sqlalchemy import create_engine, Column, Integer, String, JSON, DateTime
+from sqlalchemy import create_engine, event, func, inspect, insert, text, Column, Index, Integer, String, JSON, DateTime, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from datetime import datetime
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.types import TypeDecorator
+import orjson
+import zstandard
+import threading
+from typing import Dict, List
 
 Base = declarative_base()
 
+DATABASE_URL = "sqlite:///./infrastructure.db"
+
+# Scan blobs are long lists of near-identical records, which compress well
+# even at a fast level
+ZSTD_LEVEL = 6
+
+class CompressedJSON(TypeDecorator):
+    """JSON stored as zstd-compressed orjson bytes."""
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        # Compressor objects are not thread-safe, so create one per value
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(orjson.dumps(value))
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return orjson.loads(zstandard.ZstdDecompressor().decompress(value))
+
 class InfrastructureData(Base):
     __tablename__ = 'infrastructure_data'
+    # Serves the latest-scan-per-provider lookup; a plain ascending index is
+    # walked backwards for the DESC ordering on every backend
+    __table_args__ = (
+        Index('ix_provider_time', 'cloud_provider', 'scan_timestamp'),
+    )
     
     id = Column(Integer, primary_key=True)
     cloud_provider = Column(String)
-    scan_timestamp = Column(DateTime, default=datetime.utcnow)
-    data = Column(JSON)
+    # The SQL default is rendered into each INSERT, so it also applies to tables
+    # created before server_default was added; the server default covers
+    # writers outside SQLAlchemy
+    scan_timestamp = Column(DateTime(timezone=True), default=func.now(), server_default=func.now())
+    data = Column(JSON)  # Only set on rows stored before compression was added
+    data_zstd = Column(CompressedJSON)
+
+def _json_serializer(obj) -> str:
+    return orjson.dumps(obj).decode()
+
+def _enable_sqlite_wal(dbapi_connection, connection_record):
+    # WAL lets readers proceed while a scan is being written; under WAL,
+    # synchronous=NORMAL stays consistent without an fsync on every commit
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+def _create_indexes(engine):
+    # create_all only creates indexes along with a new table, so add any that
+    # are missing from databases created before they were declared
+    for index in InfrastructureData.__table__.indexes:
+        index.create(engine, checkfirst=True)
+
+def _add_compressed_column(engine):
+    # create_all doesn't alter existing tables, so add the column to databases
+    # created before scan data was compressed
+    columns = {column['name'] for column in inspect(engine).get_columns(InfrastructureData.__tablename__)}
+    if 'data_zstd' not in columns:
+        column_type = InfrastructureData.__table__.c.data_zstd.type.compile(engine.dialect)
+        with engine.begin() as connection:
+            connection.execute(text(f"ALTER TABLE {InfrastructureData.__tablename__} ADD COLUMN data_zstd {column_type}"))
 
-def init_db(database_url: str = "sqlite:///./infrastructure.db"):
-    engine = create_engine(database_url)
+def _create_engine(database_url: str, **options):
+    is_sqlite = database_url.startswith("sqlite")
+    # Scan blobs can be several MB, so use orjson rather than the stdlib json module
+    engine = create_engine(
+        database_url,
+        json_serializer=_json_serializer,
+        json_deserializer=orjson.loads,
+        # Sessions are handed between FastAPI's worker threads
+        connect_args={'check_same_thread': False} if is_sqlite else {},
+        **options
+    )
+    if is_sqlite:
+        event.listen(engine, "connect", _enable_sqlite_wal)
+    return engine
+
+def init_db(database_url: str = DATABASE_URL):
+    engine = _create_engine(database_url)
     Base.metadata.create_all(engine)
+    _create_indexes(engine)
+    _add_compressed_column(engine)
     SessionLocal = sessionmaker(bind=engine)
     return SessionLocal
 
+def init_read_db(database_url: str = DATABASE_URL):
+    """Create a session factory for read-only work, like the query endpoints.
+
+    Its engine runs in autocommit mode with a larger pool of its own, and its
+    sessions never flush or expire loaded objects. Use init_db's sessions for
+    writes.
+    """
+    engine = _create_engine(
+        database_url,
+        poolclass=QueuePool,
+        pool_size=20,
+        max_overflow=10,
+        pool_recycle=3600,
+        isolation_level="AUTOCOMMIT"
+    )
+    return sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
 def store_infrastructure_data(session, cloud_provider: str, data: dict):
     infra_data = InfrastructureData(
         cloud_provider=cloud_provider,
-        data=data
+        data_zstd=data
     )
     session.add(infra_data)
     session.commit()
     return infra_data
 
+def store_infrastructure_data_bulk(session, rows: List[Dict]):
+    """Store several scans with one executemany insert and a single commit.
+
+    Each row is a dict with 'cloud_provider' and 'data' keys.
+    """
+    if rows:
+        session.execute(insert(InfrastructureData), [
+            {'cloud_provider': row['cloud_provider'], 'data_zstd': row['data']} for row in rows
+        ])
+        session.commit()
+
+# Last result of get_latest_infrastructure_data_cached: (database url, max id, data)
+_latest_snapshot = (None, None, None)
+_latest_snapshot_lock = threading.Lock()
+
 def get_latest_infrastructure_data(session):
     """Get the most recent infrastructure data for all cloud providers."""
-    latest_data = {}
-    for provider in ['aws', 'azure']:
-        result = (session.query(InfrastructureData)
-                 .filter(InfrastructureData.cloud_provider == provider)
-                 .order_by(InfrastructureData.scan_timestamp.desc())
-                 .first())
-        if result:
-            latest_data[provider] = result.data
-    return latest_data
+    # Rank scans per provider by id and timestamp only, then load the data
+    # blob for the newest row of each provider in the same round trip
+    ranked = (session.query(
+                  InfrastructureData.id,
+                  func.row_number().over(
+                      partition_by=InfrastructureData.cloud_provider,
+                      # SQLite's CURRENT_TIMESTAMP has one-second resolution, so
+                      # break ties between scans stored in the same second by id
+                      order_by=(InfrastructureData.scan_timestamp.desc(), InfrastructureData.id.desc())
+                  ).label('rn'))
+              .subquery())
+    results = (session.query(InfrastructureData.cloud_provider, InfrastructureData.data_zstd, InfrastructureData.data)
+               .join(ranked, InfrastructureData.id == ranked.c.id)
+               .filter(ranked.c.rn == 1)
+               .all())
+    return {provider: compressed if compressed is not None else data
+            for provider, compressed, data in results}
+
+def get_latest_infrastructure_data_cached(session):
+    """Like get_latest_infrastructure_data, but reuse the last result until a
+    new scan is stored.
+
+    The snapshot is keyed on the highest row id, which every store bumps and
+    which is a primary-key lookup, so stores from other processes invalidate
+    it too. The returned dict is shared between callers and must not be
+    modified.
+    """
+    global _latest_snapshot
+    url = str(session.bind.url)
+    max_id = session.query(func.max(InfrastructureData.id)).scalar()
+    cached_url, cached_id, data = _latest_snapshot
+    if cached_url == url and cached_id == max_id:
+        return data
+    data = get_latest_infrastructure_data(session)
+    with _latest_snapshot_lock:
+        _latest_snapshot = (url, max_id, data)
+    return data
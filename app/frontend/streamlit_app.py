@@ -1,8 +1,12 @@
 import streamlit as st
-import requests
+import httpx
 import plotly.graph_objects as go
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from streamlit_option_menu import option_menu
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Configure the page
 st.set_page_config(
@@ -29,14 +33,59 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+API_URL = "http://localhost:8006"
+
+# Scans walk every region so they get a longer read timeout. Streamed answers
+# reset the read timeout with every chunk, but Both Clouds queries wait for
+# the complete answer to all three scopes.
+SCAN_TIMEOUT = httpx.Timeout(300, connect=3)
+QUERY_TIMEOUT = httpx.Timeout(120, connect=3)
+
+# Sidebar navigation; fixed, so the menu component gets identical arguments every run
+MENU_OPTIONS = ("Dashboard", "AWS Scanner", "Azure Scanner", "Query Infrastructure")
+MENU_ICONS = ('house', 'cloud-fill', 'microsoft', 'chat-dots')
+
+# Query page radio options and the /query scope that answers each
+QUERY_SCOPES = {"AWS Only": "aws", "Azure Only": "azure", "Both Clouds": "both"}
+
+@st.cache_resource
+def get_client():
+    """Create one pooled HTTP client for the backend, reused across reruns."""
+    return httpx.Client(
+        base_url=API_URL,
+        # Retries connection failures only, like the previous urllib3 policy for POSTs
+        transport=httpx.HTTPTransport(
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            retries=3
+        )
+    )
+
+# Scan results are memoized on their arguments so reruns triggered by unrelated
+# widgets don't repeat the scan; failed requests raise and are never cached
+SCAN_CACHE_TTL = 300
+
+@st.cache_data(ttl=SCAN_CACHE_TTL, show_spinner=False)
+def _cached_scan_aws(services):
+    params = {}
+    if services:
+        params['services'] = list(services)
+    response = get_client().post("/scan/aws", params=params, timeout=SCAN_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+@st.cache_data(ttl=SCAN_CACHE_TTL, show_spinner=False)
+def _cached_scan_azure(subscription_id, services):
+    params = {'subscription_id': subscription_id}
+    if services:
+        params['services'] = list(services)
+    response = get_client().post("/scan/azure", params=params, timeout=SCAN_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
 def scan_aws(services=None):
     """Scan AWS infrastructure"""
     try:
-        params = {}
-        if services:
-            params['services'] = services
-        response = requests.post("http://localhost:8006/scan/aws", params=params)
-        return response.json()
+        return _cached_scan_aws(tuple(services or ()))
     except Exception as e:
         st.error(f"Error scanning AWS: {str(e)}")
         return None
@@ -44,65 +93,92 @@ def scan_aws(services=None):
 def scan_azure(subscription_id, services=None):
     """Scan Azure infrastructure"""
     try:
-        params = {'subscription_id': subscription_id}
-        if services:
-            params['services'] = services
-        response = requests.post("http://localhost:8006/scan/azure", params=params)
-        return response.json()
+        return _cached_scan_azure(subscription_id, tuple(services or ()))
     except Exception as e:
         st.error(f"Error scanning Azure: {str(e)}")
         return None
 
-def query_aws(question):
-    """Query AWS infrastructure using natural language"""
+def remember_scan(name, key, result):
+    """Keep a scan result in the session so later reruns can show it again"""
+    st.session_state[name] = {"key": key, "result": result, "ts": time.time()}
+
+def last_scan(name, key):
+    """Get the session's last scan result for the same arguments, if still fresh"""
+    last = st.session_state.get(name)
+    if last and last["key"] == key and time.time() - last["ts"] < SCAN_CACHE_TTL:
+        return last["result"]
+    return None
+
+def _run_with_ctx(ctx, func, *args):
+    """Run func on a worker thread attached to the script's run context"""
+    # st.cache_data looks up the session through the context; without it every
+    # call from a bare thread logs a "missing ScriptRunContext" warning
+    add_script_run_ctx(threading.current_thread(), ctx)
+    return func(*args)
+
+def scan_both(subscription_id):
+    """Scan AWS and Azure concurrently, returning (aws_data, azure_data)"""
+    # Both requests are I/O-bound, so overlapping them takes max(aws, azure)
+    # instead of aws + azure. Errors are reported here on the script thread,
+    # since Streamlit elements can't be created from the worker threads.
+    ctx = get_script_run_ctx()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        aws_future = executor.submit(_run_with_ctx, ctx, _cached_scan_aws, ())
+        azure_future = executor.submit(_run_with_ctx, ctx, _cached_scan_azure, subscription_id, ())
+
+    aws_data = azure_data = None
     try:
-        response = requests.post(
-            "http://localhost:8006/query/aws",
-            json={"question": question}
-        )
-        return response.json()
+        aws_data = aws_future.result()
     except Exception as e:
-        st.error(f"Error querying AWS infrastructure: {str(e)}")
-        return None
-
-def query_azure(question):
-    """Query Azure infrastructure using natural language"""
+        st.error(f"Error scanning AWS: {str(e)}")
     try:
-        response = requests.post(
-            "http://localhost:8006/query/azure",
-            json={"question": question}
-        )
-        return response.json()
+        azure_data = azure_future.result()
     except Exception as e:
-        st.error(f"Error querying Azure infrastructure: {str(e)}")
-        return None
+        st.error(f"Error scanning Azure: {str(e)}")
+    return aws_data, azure_data
 
-def query_all(question):
-    """Query both AWS and Azure infrastructure"""
+def query_all(question, scope):
+    """Query AWS, Azure or both clouds' infrastructure using natural language
+
+    Returns the backend's JSON body for cached answers, Both Clouds answers
+    and errors, or a dict with an 'answer_stream' iterator of text chunks for
+    st.write_stream.
+    """
     try:
-        response = requests.post(
-            "http://localhost:8006/query",
-            json={"question": question}
-        )
-        return response.json()
+        client = get_client()
+        request = client.build_request("POST", "/query", json={"question": question, "scope": scope, "stream": True},
+                                       timeout=QUERY_TIMEOUT)
+        response = client.send(request, stream=True)
+        if response.headers.get("content-type", "").startswith("text/plain"):
+            return {"answer_stream": _iter_answer(response), "cloud": scope}
+        try:
+            response.read()
+            return response.json()
+        finally:
+            response.close()
     except Exception as e:
         st.error(f"Error querying infrastructure: {str(e)}")
         return None
 
-def create_resource_chart(data, title):
-    """Create a bar chart for resource counts"""
-    resource_counts = {}
-    
-    # Count resources
-    for key, value in data.items():
-        if isinstance(value, list):
-            resource_counts[key] = len(value)
-    
+def _iter_answer(response):
+    """Yield a streamed answer's text, releasing the connection when done"""
+    try:
+        yield from response.iter_text()
+    finally:
+        response.close()
+
+def create_resource_chart(result, title):
+    """Create a bar chart for the resource counts of a scan response"""
+    return build_chart(tuple(result['counts'].items()), title)
+
+@st.cache_data(show_spinner=False)
+def build_chart(counts, title):
+    """Build the bar chart for (resource type, count) pairs, memoized across reruns"""
     # Create bar chart
     fig = go.Figure(data=[
         go.Bar(
-            x=list(resource_counts.keys()),
-            y=list(resource_counts.values()),
+            x=[resource_type for resource_type, _ in counts],
+            y=[count for _, count in counts],
             marker_color='#1E90FF'
         )
     ])
@@ -118,16 +194,30 @@ def create_resource_chart(data, title):
 
 # Sidebar navigation
 with st.sidebar:
+    # A stable key keeps the same component instance across reruns instead of
+    # mounting a new one, and the kept selection survives it being rebuilt
+    st.session_state.setdefault("nav_selected", MENU_OPTIONS[0])
     selected = option_menu(
         "CloudFinWise",
-        ["Dashboard", "AWS Scanner", "Azure Scanner", "Query Infrastructure"],
-        icons=['house', 'cloud-fill', 'microsoft', 'chat-dots'],
+        list(MENU_OPTIONS),
+        icons=list(MENU_ICONS),
         menu_icon="cloud",
-        default_index=0,
+        default_index=MENU_OPTIONS.index(st.session_state["nav_selected"]),
+        key="nav"
     )
+    st.session_state["nav_selected"] = selected or MENU_OPTIONS[0]
+
+    if st.button("♻️ Force refresh", help="Discard cached scan results"):
+        _cached_scan_aws.clear()
+        _cached_scan_azure.clear()
+        for name in ("dashboard_aws", "dashboard_azure", "aws_last", "azure_last"):
+            st.session_state.pop(name, None)
 
-# Main content
-if selected == "Dashboard":
+# Main content. Each page is a fragment, so interacting with a page's widgets
+# reruns only that page instead of the whole script.
+@st.fragment
+def dashboard_panel():
+    """Scan both clouds and chart their resources"""
     st.title("☁️ CloudFinWise Dashboard")
     st.markdown("---")
     
@@ -138,10 +228,7 @@ if selected == "Dashboard":
             with st.spinner("Scanning AWS..."):
                 aws_data = scan_aws()
                 if aws_data:
-                    st.plotly_chart(create_resource_chart(
-                        aws_data['data'],
-                        "AWS Resources Overview"
-                    ))
+                    remember_scan("dashboard_aws", (), aws_data)
     
     with col2:
         azure_sub_id = st.text_input("Azure Subscription ID")
@@ -150,14 +237,39 @@ if selected == "Dashboard":
                 with st.spinner("Scanning Azure..."):
                     azure_data = scan_azure(azure_sub_id)
                     if azure_data:
-                        st.plotly_chart(create_resource_chart(
-                            azure_data['data'],
-                            "Azure Resources Overview"
-                        ))
+                        remember_scan("dashboard_azure", azure_sub_id, azure_data)
             else:
                 st.warning("Please enter Azure Subscription ID")
 
-elif selected == "AWS Scanner":
+    if st.button("🔄 Scan Both Clouds", key="dash_both"):
+        if azure_sub_id:
+            with st.spinner("Scanning AWS and Azure..."):
+                aws_data, azure_data = scan_both(azure_sub_id)
+            if aws_data:
+                remember_scan("dashboard_aws", (), aws_data)
+            if azure_data:
+                remember_scan("dashboard_azure", azure_sub_id, azure_data)
+        else:
+            st.warning("Please enter Azure Subscription ID")
+
+    # Charts are drawn from the session, so they stay up when other widgets rerun the script
+    col1, col2 = st.columns(2)
+    aws_data = last_scan("dashboard_aws", ())
+    if aws_data:
+        col1.plotly_chart(create_resource_chart(
+            aws_data,
+            "AWS Resources Overview"
+        ))
+    azure_data = last_scan("dashboard_azure", azure_sub_id)
+    if azure_data:
+        col2.plotly_chart(create_resource_chart(
+            azure_data,
+            "Azure Resources Overview"
+        ))
+
+@st.fragment
+def aws_scanner_panel():
+    """Scan selected AWS services"""
     st.title("AWS Infrastructure Scanner")
     st.markdown("---")
     
@@ -171,10 +283,17 @@ elif selected == "AWS Scanner":
         with st.spinner("Scanning AWS infrastructure..."):
             result = scan_aws(services)
             if result:
+                remember_scan("aws_last", tuple(services), result)
                 st.success("Scan completed!")
-                st.json(result['data'])
 
-elif selected == "Azure Scanner":
+    # Shown again on reruns until the selected services change
+    result = last_scan("aws_last", tuple(services))
+    if result:
+        st.json(result['data'])
+
+@st.fragment
+def azure_scanner_panel():
+    """Scan selected Azure services"""
     st.title("Azure Infrastructure Scanner")
     st.markdown("---")
     
@@ -190,19 +309,26 @@ elif selected == "Azure Scanner":
             with st.spinner("Scanning Azure infrastructure..."):
                 result = scan_azure(subscription_id, services)
                 if result:
+                    remember_scan("azure_last", (subscription_id, tuple(services)), result)
                     st.success("Scan completed!")
-                    st.json(result['data'])
         else:
             st.warning("Please enter Azure Subscription ID")
 
-elif selected == "Query Infrastructure":
+    # Shown again on reruns until the subscription or selected services change
+    result = last_scan("azure_last", (subscription_id, tuple(services)))
+    if result:
+        st.json(result['data'])
+
+@st.fragment
+def query_panel():
+    """Ask questions about the scanned infrastructure"""
     st.title("Query Infrastructure")
     st.markdown("---")
     
     # Select which cloud to query
     cloud = st.radio(
         "Select Cloud Provider",
-        ["AWS Only", "Azure Only", "Both Clouds"],
+        list(QUERY_SCOPES),
         horizontal=True
     )
     
@@ -229,29 +355,36 @@ elif selected == "Query Infrastructure":
     
     if st.button("🤖 Ask"):
         if question:
+            # The spinner only covers the wait for the first byte; streamed
+            # answers are then rendered token by token as they arrive
             with st.spinner("Analyzing..."):
-                if cloud == "AWS Only":
-                    result = query_aws(question)
-                elif cloud == "Azure Only":
-                    result = query_azure(question)
-                else:  # Both Clouds
-                    result = query_all(question)
+                # A Both Clouds answer also covers each cloud, so switching to
+                # one cloud for the same question doesn't query GPT-4 again
+                result = query_all(question, QUERY_SCOPES[cloud])
                     
-                if result:
-                    if 'error' in result:
-                        if result['error'] in ['no_data', 'no_azure_data', 'no_aws_data']:
-                            st.warning(result['answer'])
-                        else:
-                            st.error(result['answer'])
+            if result:
+                if 'error' in result:
+                    if result['error'] in ['no_data', 'no_azure_data', 'no_aws_data']:
+                        st.warning(result['answer'])
+                    else:
+                        st.error(result['answer'])
+                elif 'detail' in result:
+                    st.error(result['detail'])
+                else:
+                    st.markdown("### Answer")
+                    if 'answer_stream' in result:
+                        st.write_stream(result['answer_stream'])
                     else:
-                        st.success("Analysis complete!")
-                        st.markdown("### Answer")
                         st.write(result['answer'])
-                        
-                        # Show which cloud was queried
-                        if 'cloud' in result:
-                            st.info(f"Analyzed {result['cloud'].upper()} infrastructure")
-                        elif 'clouds' in result:
-                            st.info(f"Analyzed infrastructure from: {', '.join(result['clouds']).upper()}")
+                    st.success("Analysis complete!")
+                    
+                    # Show which cloud was queried
+                    if 'cloud' in result:
+                        st.info(f"Analyzed {result['cloud'].upper()} infrastructure")
+                    elif 'clouds' in result:
+                        st.info(f"Analyzed infrastructure from: {', '.join(result['clouds']).upper()}")
         else:
             st.warning("Please enter a question")
+
+PANELS = dict(zip(MENU_OPTIONS, (dashboard_panel, aws_scanner_panel, azure_scanner_panel, query_panel)))
+PANELS[st.session_state["nav_selected"]]()
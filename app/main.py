@@ -1,19 +1,200 @@
-from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi import FastAPI, Depends, HTTPException, Query, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import List, Literal, Optional
 from typing import Dict
-import openai
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from cachetools import TTLCache
+from openai import AsyncOpenAI
+import asyncio
+import hashlib
+import logging
+import orjson
 import os
+import weakref
 from dotenv import load_dotenv
 
 from cloud_scanners.aws_scanner import AWSScanner
 from cloud_scanners.azure_scanner import AzureScanner
-from database import init_db, store_infrastructure_data, get_latest_infrastructure_data
+from database import init_db, init_read_db, store_infrastructure_data_bulk, get_latest_infrastructure_data_cached
+from prompt_context import estimate_max_tokens, summarize_for_llm
 
 load_dotenv()
 
-app = FastAPI(title="Cloud Infrastructure Scanner")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build the scanners once so clients, credentials and connection pools
+    are shared by every scan instead of being set up per request."""
+    # AWSScanner looks up the enabled regions when it is constructed
+    app.state.aws_scanner = await asyncio.to_thread(AWSScanner)
+    app.state.azure_scanner = AzureScanner()
+    yield
+
+# Scan responses can be several MB, so encode them with orjson
+app = FastAPI(title="Cloud Infrastructure Scanner", lifespan=lifespan, default_response_class=ORJSONResponse)
+# Scan responses carry the full resource lists, which gzip shrinks several times
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 SessionLocal = init_db()
+# Query endpoints only read the latest snapshot, so they use a read-only pool
+ReadSession = init_read_db()
+
+@lru_cache(maxsize=1)
+def get_openai_client() -> AsyncOpenAI:
+    """Create the OpenAI client on first use, after .env has been loaded."""
+    return AsyncOpenAI()
+
+# GPT-4 answers keyed by answer_cache_key; identical questions about an
+# unchanged snapshot are answered without another LLM call
+_ANSWER_CACHE = TTLCache(maxsize=1024, ttl=3600)
+# One lock per key so concurrent identical requests share a single LLM call
+_answer_locks = weakref.WeakValueDictionary()
+
+def build_context(data: Dict, question: str) -> str:
+    """Serialize the compact projection of scan data included in a prompt."""
+    return orjson.dumps(summarize_for_llm(data, question), option=orjson.OPT_SORT_KEYS, default=str).decode()
+
+def answer_cache_key(scope: str, question: str, context: str) -> str:
+    """Fingerprint a question together with the exact context it is asked about."""
+    return hashlib.sha256(f"{scope}\0{question}\0{context}".encode()).hexdigest()
+
+async def _complete(system_prompt: str, user_prompt: str, max_tokens: int = 500, **options):
+    """Call GPT-4 and return the first choice, including its finish_reason."""
+    response = await get_openai_client().chat.completions.create(
+        model="gpt-4-turbo-preview",
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ],
+        temperature=0.7,
+        max_tokens=max_tokens,
+        **options
+    )
+    return response.choices[0]
+
+async def _generate_answer(system_prompt: str, user_prompt: str, max_tokens: int = 500, **options) -> str:
+    """Call GPT-4 and return the full answer."""
+    return (await _complete(system_prompt, user_prompt, max_tokens=max_tokens, **options)).message.content
+
+# Sections of a combined /query answer; "both" is answered by "combined"
+ANSWER_SECTIONS = {"aws": "aws", "azure": "azure", "both": "combined"}
+
+SECTIONED_SYSTEM_PROMPT = """You are an expert in both AWS and Azure cloud infrastructure. 
+Analyze the provided infrastructure data and answer the user's question three ways. 
+Respond with a JSON object with the string keys "aws", "azure" and "combined": 
+"aws" considers only AWS resources, "azure" only Azure resources, and "combined" 
+considers resources from both clouds. If a cloud has no data, say so in its section. 
+Provide clear, actionable insights in each section."""
+
+# Completion tokens for the keys, quotes and braces around the three sections
+SECTIONS_JSON_TOKENS = 30
+
+class IncompleteSectionsError(Exception):
+    """GPT-4's sectioned answer was cut off or was not a JSON object."""
+
+    def __init__(self, content: str):
+        super().__init__("Sectioned answer could not be parsed")
+        self.content = content
+
+def _parse_sections(content: Optional[str]) -> Optional[Dict]:
+    try:
+        sections = orjson.loads(content or "")
+    except orjson.JSONDecodeError:
+        return None
+    return sections if isinstance(sections, dict) else None
+
+async def _generate_sections(system_prompt: str, user_prompt: str, max_tokens: int = 500) -> Dict[str, str]:
+    """Call GPT-4 once for the per-cloud and combined answers to a question.
+
+    Raises IncompleteSectionsError with the raw answer if it can't be parsed.
+    """
+    # Three answers in one response plus the JSON around them. An answer cut
+    # off at the cap is invalid JSON, so retry once with twice the room.
+    cap = 3 * max_tokens + SECTIONS_JSON_TOKENS
+    for attempt_cap in (cap, 2 * cap):
+        choice = await _complete(system_prompt, user_prompt, max_tokens=attempt_cap,
+                                 response_format={"type": "json_object"})
+        if choice.finish_reason != "length":
+            sections = _parse_sections(choice.message.content)
+            if sections is not None:
+                return sections
+            # A complete but malformed answer won't improve with more tokens
+            break
+    raise IncompleteSectionsError(choice.message.content or "")
+
+def _section_answer(sections: Dict, scope: str) -> str:
+    answer = sections.get(ANSWER_SECTIONS[scope])
+    if not answer:
+        return "No answer was generated for this scope."
+    return answer if isinstance(answer, str) else orjson.dumps(answer).decode()
+
+async def cached_answer(cache_key: str, system_prompt: str, user_prompt: str, generate=_generate_answer,
+                        max_tokens: int = 500):
+    """Return the cached answer for the key, generating it at most once."""
+    answer = _ANSWER_CACHE.get(cache_key)
+    if answer is not None:
+        return answer
+    lock = _answer_locks.get(cache_key)
+    if lock is None:
+        lock = asyncio.Lock()
+        _answer_locks[cache_key] = lock
+    async with lock:
+        answer = _ANSWER_CACHE.get(cache_key)
+        if answer is None:
+            answer = await generate(system_prompt, user_prompt, max_tokens=max_tokens)
+            _ANSWER_CACHE[cache_key] = answer
+    return answer
+
+async def _stream_answer(system_prompt: str, user_prompt: str, cache_key: str, max_tokens: int = 500):
+    """Yield GPT-4 answer tokens as they are generated, caching the full answer."""
+    parts = []
+    try:
+        stream = await get_openai_client().chat.completions.create(
+            model="gpt-4-turbo-preview",
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=0.7,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+        _ANSWER_CACHE[cache_key] = "".join(parts)
+    except Exception as e:
+        # The status line has already been sent, so report the error in-band
+        logging.error(f"Error streaming answer: {str(e)}")
+        yield f"\n\nError generating answer: {str(e)}"
+
+def streaming_answer(system_prompt: str, user_prompt: str, cache_key: str, max_tokens: int = 500) -> StreamingResponse:
+    """Stream the answer as chunked plain text."""
+    return StreamingResponse(
+        _stream_answer(system_prompt, user_prompt, cache_key, max_tokens),
+        media_type="text/plain",
+        # Opt out of gzip, which would buffer tokens instead of sending each chunk
+        headers={"Content-Encoding": "identity"}
+    )
+
+def resource_counts(data: Dict) -> Dict[str, int]:
+    """Count the resources of each type in a scan, for the dashboard charts."""
+    return {key: len(value) for key, value in data.items() if isinstance(value, list)}
+
+class QueryRequest(BaseModel):
+    question: str = Field(..., min_length=1, max_length=2000)
+    # Only used by /query; see query_infrastructure
+    scope: Optional[Literal["aws", "azure", "both"]] = None
+    # Stream uncached answers as plain text instead of returning JSON
+    stream: bool = False
+
+def load_latest_infrastructure_data() -> Dict:
+    """Get the latest infrastructure data using a short-lived read-only session."""
+    with ReadSession() as session:
+        return get_latest_infrastructure_data_cached(session)
 
 def get_db():
     db = SessionLocal()
@@ -24,190 +205,172 @@ def get_db():
 
 @app.post("/scan/aws")
 async def scan_aws(
+    request: Request,
     services: Optional[List[str]] = Query(None, description="List of services to scan (ec2, vpc, s3, rds, lambda, cloudwatch, logs)"),
     db: Session = Depends(get_db)
 ):
     """Scan AWS infrastructure and store the results."""
     try:
-        scanner = AWSScanner()
-        infrastructure_data = scanner.scan_resources(services=services)
-        store_infrastructure_data(db, "aws", infrastructure_data)
-        return {"message": "AWS infrastructure scan completed", "data": infrastructure_data}
+        scanner = request.app.state.aws_scanner
+        # Scanning and storing block on I/O, so run them off the event loop
+        infrastructure_data = await asyncio.to_thread(scanner.scan_resources, services=services)
+        # A Core insert skips building and flushing an ORM object for the row
+        await asyncio.to_thread(store_infrastructure_data_bulk, db,
+                                [{"cloud_provider": "aws", "data": infrastructure_data}])
+        return {"message": "AWS infrastructure scan completed", "data": infrastructure_data,
+                "counts": resource_counts(infrastructure_data)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/scan/azure")
 async def scan_azure(
+    request: Request,
     subscription_id: Optional[str] = Query(None, description="Azure subscription ID. If not provided, uses default subscription"),
     services: Optional[List[str]] = Query(None, description="List of services to scan (compute, network, storage, web, container, cosmos, sql)"),
     db: Session = Depends(get_db)
 ):
     """Scan Azure infrastructure and store the results."""
     try:
-        scanner = AzureScanner()
-        infrastructure_data = scanner.scan_resources(subscription_id, services=services)
-        store_infrastructure_data(db, "azure", infrastructure_data)
-        return {"message": "Azure infrastructure scan completed", "data": infrastructure_data}
+        scanner = request.app.state.azure_scanner
+        # Scanning and storing block on I/O, so run them off the event loop
+        infrastructure_data = await asyncio.to_thread(scanner.scan_resources, subscription_id, services=services)
+        # A Core insert skips building and flushing an ORM object for the row
+        await asyncio.to_thread(store_infrastructure_data_bulk, db,
+                                [{"cloud_provider": "azure", "data": infrastructure_data}])
+        return {"message": "Azure infrastructure scan completed", "data": infrastructure_data,
+                "counts": resource_counts(infrastructure_data)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/query/aws")
-async def query_aws_infrastructure(request: dict, db: Session = Depends(get_db)):
-    question = request.get("question")
-    """Query AWS infrastructure using GPT-4."""
-    try:
-        # Get latest AWS data
-        aws_data = get_latest_infrastructure_data(db).get('aws')
-        
-        if not aws_data:
-            raise HTTPException(status_code=404, detail="No AWS infrastructure data found")
-            
-        # Prepare the prompt for GPT-4
-        system_prompt = """You are an AWS cloud infrastructure expert. 
-        Analyze the provided AWS infrastructure data and answer the user's question. 
-        Focus only on AWS resources and provide clear, actionable insights."""
-        
-        user_prompt = f"""
-        AWS Infrastructure Data:
-        {aws_data}
-        
-        User Question:
-        {question}
-        """
-        
-        # Call GPT-4
-        response = openai.chat.completions.create(
-            model="gpt-4-turbo-preview",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.7,
-            max_tokens=500
-        )
-        
-        return {
-            "question": question,
-            "answer": response.choices[0].message.content,
-            "cloud": "aws"
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+# Per-scope system prompts and the label for the data in the user prompt
+SYSTEM_PROMPTS = {
+    "aws": """You are an AWS cloud infrastructure expert. 
+    Analyze the provided AWS infrastructure data and answer the user's question. 
+    Focus only on AWS resources and provide clear, actionable insights.""",
+    "azure": """You are an Azure cloud infrastructure expert. 
+    Analyze the provided Azure infrastructure data and answer the user's question. 
+    Focus only on Azure resources and provide clear, actionable insights.""",
+    "both": """You are an expert in both AWS and Azure cloud infrastructure. 
+    Analyze the provided infrastructure data and answer the user's question. 
+    Consider resources from both clouds and provide comprehensive insights."""
+}
+DATA_LABELS = {"aws": "AWS Infrastructure Data", "azure": "Azure Infrastructure Data", "both": "Infrastructure Data"}
+CLOUD_NAMES = {"aws": "AWS", "azure": "Azure", "both": "cloud"}
 
-@app.post("/query/azure")
-async def query_azure_infrastructure(request: dict, db: Session = Depends(get_db)):
-    """Query Azure infrastructure using GPT-4."""
-    try:
-        question = request.get("question")
-        if not question:
-            raise HTTPException(status_code=400, detail="Question is required")
+def _query_response(question: str, scope: str, clouds: List[str], answer: str,
+                    error: Optional[str] = None, sectioned: bool = False) -> Dict:
+    response = {"question": question, "answer": answer}
+    if error:
+        response["error"] = error
+    if sectioned:
+        response["scope"] = scope
+    if scope == "both":
+        response["clouds"] = clouds
+    else:
+        response["cloud"] = scope
+    return response
+
+def _store_cloud_sections(question: str, infrastructure_data: Dict, sections: Dict):
+    """Cache the per-cloud sections of a combined answer as single-scope answers."""
+    for cloud in ("aws", "azure"):
+        answer = sections.get(ANSWER_SECTIONS[cloud])
+        if infrastructure_data.get(cloud) and isinstance(answer, str) and answer:
+            cache_key = answer_cache_key(cloud, question, build_context(infrastructure_data[cloud], question))
+            _ANSWER_CACHE.setdefault(cache_key, answer)
 
-        # Get latest Azure data
-        infrastructure_data = get_latest_infrastructure_data(db)
+async def _do_query(question: str, scope: str, stream: bool = False, sectioned: bool = False):
+    """Answer a question about the latest AWS, Azure or combined scan data.
+
+    With sectioned, which only applies to the "both" scope, one GPT-4 call
+    also writes the AWS and Azure answers, and those are cached for later
+    single-cloud questions; sectioned answers are returned as JSON, since a
+    section can't be shown before the whole object has been parsed.
+    Otherwise uncached answers are streamed as plain text when stream is set.
+    Missing scan data is reported in the response body rather than as an
+    error.
+    """
+    try:
+        infrastructure_data = await asyncio.to_thread(load_latest_infrastructure_data)
         if not infrastructure_data:
-            return {
-                "question": question,
-                "answer": "No infrastructure data found. Please scan your Azure resources first.",
-                "cloud": "azure",
-                "error": "no_data"
-            }
-
-        azure_data = infrastructure_data.get('azure')
-        if not azure_data:
-            return {
-                "question": question,
-                "answer": "No Azure infrastructure data found. Please scan your Azure resources first.",
-                "cloud": "azure",
-                "error": "no_azure_data"
-            }
-
-        # Prepare the prompt for GPT-4
-        system_prompt = """You are an Azure cloud infrastructure expert. 
-        Analyze the provided Azure infrastructure data and answer the user's question. 
-        Focus only on Azure resources and provide clear, actionable insights."""
+            return _query_response(question, scope, [],
+                                   f"No infrastructure data found. Please scan your {CLOUD_NAMES[scope]} resources first.",
+                                   error="no_data")
 
-        user_prompt = f"""
-        Azure Infrastructure Data:
-        {azure_data}
+        if scope != "both" and not infrastructure_data.get(scope):
+            return _query_response(question, scope, [],
+                                   f"No {CLOUD_NAMES[scope]} infrastructure data found. "
+                                   f"Please scan your {CLOUD_NAMES[scope]} resources first.",
+                                   error=f"no_{scope}_data")
+        data = infrastructure_data if scope == "both" else infrastructure_data[scope]
+        clouds = list(infrastructure_data.keys()) if scope == "both" else [scope]
 
+        # Counts for everything, details only for what the question names
+        context = build_context(data, question)
+        # Short factual questions get a smaller completion cap, which ends decoding sooner
+        max_tokens = estimate_max_tokens(question)
+
+        user_prompt = f"""
+        {DATA_LABELS[scope]}:
+        {context}
+        
         User Question:
         {question}
         """
 
-        # Call GPT-4
-        response = openai.chat.completions.create(
-            model="gpt-4-turbo-preview",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.7,
-            max_tokens=500
-        )
+        if sectioned:
+            cache_key = answer_cache_key("sections", question, context)
+            is_cached = cache_key in _ANSWER_CACHE
+            try:
+                sections = await cached_answer(cache_key, SECTIONED_SYSTEM_PROMPT, user_prompt,
+                                               generate=_generate_sections, max_tokens=max_tokens)
+            except IncompleteSectionsError as e:
+                # Show what GPT-4 produced rather than failing; it isn't cached,
+                # so asking again makes a fresh attempt
+                logging.warning(f"Could not parse sectioned answer: {str(e)}")
+                return _query_response(question, scope, clouds, e.content, sectioned=True)
+            if not is_cached:
+                # Switching to one cloud for the same question then needs no GPT-4 call
+                _store_cloud_sections(question, infrastructure_data, sections)
+            return _query_response(question, scope, clouds, _section_answer(sections, scope), sectioned=True)
 
-        return {
-            "question": question,
-            "answer": response.choices[0].message.content,
-            "cloud": "azure"
-        }
+        # Answers are cached per question and snapshot; only uncached ones are streamed
+        system_prompt = SYSTEM_PROMPTS[scope]
+        cache_key = answer_cache_key(scope, question, context)
+        if stream and cache_key not in _ANSWER_CACHE:
+            return streaming_answer(system_prompt, user_prompt, cache_key, max_tokens)
+
+        answer = await cached_answer(cache_key, system_prompt, user_prompt, max_tokens=max_tokens)
+        return _query_response(question, scope, clouds, answer)
 
-    except HTTPException as he:
-        raise he
-    except Exception as e:
-        logging.error(f"Error querying Azure infrastructure: {str(e)}")
-        return {
-            "question": question,
-            "answer": f"Error analyzing Azure infrastructure: {str(e)}",
-            "cloud": "azure",
-            "error": "query_error"
-        }
-        
     except Exception as e:
+        logging.error(f"Error querying {CLOUD_NAMES[scope]} infrastructure: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/query/aws")
+async def query_aws_infrastructure(body: QueryRequest):
+    """Query AWS infrastructure using GPT-4."""
+    return await _do_query(body.question, "aws", stream=body.stream)
+
+@app.post("/query/azure")
+async def query_azure_infrastructure(body: QueryRequest):
+    """Query Azure infrastructure using GPT-4."""
+    return await _do_query(body.question, "azure", stream=body.stream)
+
 @app.post("/query")
-async def query_infrastructure(request: dict, db: Session = Depends(get_db)):
-    question = request.get("question")
-    """Query both AWS and Azure infrastructure using GPT-4."""
-    try:
-        infrastructure_data = get_latest_infrastructure_data(db)
-        
-        if not infrastructure_data:
-            raise HTTPException(status_code=404, detail="No infrastructure data found")
-            
-        # Prepare the prompt for GPT-4
-        system_prompt = """You are an expert in both AWS and Azure cloud infrastructure. 
-        Analyze the provided infrastructure data and answer the user's question. 
-        Consider resources from both clouds and provide comprehensive insights."""
-        
-        user_prompt = f"""
-        Infrastructure Data:
-        {infrastructure_data}
-        
-        User Question:
-        {question}
-        """
-        
-        # Call GPT-4
-        response = openai.chat.completions.create(
-            model="gpt-4-turbo-preview",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.7,
-            max_tokens=500
-        )
-        
-        return {
-            "question": question,
-            "answer": response.choices[0].message.content,
-            "clouds": list(infrastructure_data.keys())
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+async def query_infrastructure(body: QueryRequest):
+    """Query both AWS and Azure infrastructure using GPT-4.
+
+    A "scope" of aws or azure answers for that cloud alone, like the
+    per-cloud endpoints. A scope of both makes one GPT-4 call that also
+    answers for each cloud, so switching the Query page to a single cloud
+    for the same question is served from the answer cache. That combined
+    answer is always returned as JSON; the other scopes can be streamed.
+    """
+    if body.scope in ("aws", "azure"):
+        return await _do_query(body.question, body.scope, stream=body.stream)
+    if body.scope == "both":
+        return await _do_query(body.question, "both", sectioned=True)
+    return await _do_query(body.question, "both", stream=body.stream)
 
 if __name__ == "__main__":
     import uvicorn
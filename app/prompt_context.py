@@ -0,0 +1,112 @@
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+
+# Field that identifies a resource of each type; types not listed use 'name'.
+# Picked per type because records also carry the IDs of related resources,
+# such as the vpc_id of a security group
+ID_FIELDS = {
+    'ec2_instances': 'instance_id',
+    'vpcs': 'vpc_id',
+    'security_groups': 'group_id',
+    'rds_instances': 'db_identifier',
+    'lambda_functions': 'function_name',
+    'elasticache_clusters': 'cluster_id',
+    'load_balancers': 'arn'
+}
+
+# Low-cardinality fields tallied over all resources of a relevant type, so
+# questions like "how many instances are running" don't depend on the sample
+BREAKDOWN_FIELDS = ('state', 'status', 'instance_type', 'vm_size', 'engine', 'runtime', 'region', 'location')
+
+# Full resource records included per relevant resource type
+SAMPLE_SIZE = 5
+
+# Upper bound on identifiers listed per resource type
+MAX_IDS = 200
+
+# Question keywords that make a resource type relevant. Keywords match at the
+# start of a word, so 'instance' also matches 'instances'.
+RESOURCE_KEYWORDS = {
+    'ec2_instances': ('ec2', 'instance', 'compute', 'server'),
+    'virtual_machines': ('vm', 'virtual machine', 'compute', 'server'),
+    'vpcs': ('vpc', 'network', 'cidr', 'subnet'),
+    'virtual_networks': ('vnet', 'virtual network', 'network', 'address space', 'subnet'),
+    'security_groups': ('security group', 'firewall'),
+    'network_security_groups': ('nsg', 'security group', 'firewall'),
+    's3_buckets': ('s3', 'bucket', 'storage'),
+    'storage_accounts': ('storage', 'blob'),
+    'rds_instances': ('rds', 'database', 'db', 'sql', 'postgres', 'mysql'),
+    'sql_servers': ('sql', 'database', 'db'),
+    'cosmos_db': ('cosmos', 'database', 'db', 'nosql'),
+    'dynamodb_tables': ('dynamo', 'table', 'database', 'nosql'),
+    'lambda_functions': ('lambda', 'function', 'serverless', 'runtime'),
+    'web_apps': ('web app', 'app service', 'website', 'function'),
+    'load_balancers': ('load balancer', 'elb', 'alb', 'nlb'),
+    'eks_clusters': ('eks', 'kubernetes', 'k8s', 'cluster'),
+    'aks_clusters': ('aks', 'kubernetes', 'k8s', 'cluster'),
+    'elasticache_clusters': ('elasticache', 'cache', 'redis', 'memcached'),
+    'cloudwatch_logs': ('log', 'cloudwatch', 'retention'),
+    'resource_groups': ('resource group',)
+}
+
+# Completion token caps: a count or yes/no fits in a sentence or two, anything
+# else may need a list or an explanation
+SHORT_ANSWER_TOKENS = 80
+LONG_ANSWER_TOKENS = 500
+
+SHORT_QUESTION_PATTERN = re.compile(r"\b(how many|count|total|is there|are there)\b")
+LONG_QUESTION_PATTERN = re.compile(r"\b(list|show|compare|explain|why|recommend|which)\b")
+
+def estimate_max_tokens(question: str) -> int:
+    """Cap the answer length for short factual questions like "how many X"."""
+    question = question.lower()
+    if SHORT_QUESTION_PATTERN.search(question) and not LONG_QUESTION_PATTERN.search(question):
+        return SHORT_ANSWER_TOKENS
+    return LONG_ANSWER_TOKENS
+
+def relevant_resource_types(question: Optional[str]) -> Optional[set]:
+    """Get the resource types a question refers to, or None if it names none."""
+    if not question:
+        return None
+    question = question.lower()
+    matched = {
+        resource_type
+        for resource_type, keywords in RESOURCE_KEYWORDS.items()
+        if any(re.search(r'\b' + re.escape(keyword), question) for keyword in keywords)
+    }
+    return matched or None
+
+def _resource_id(resource_type: str, resource: Dict):
+    return resource.get(ID_FIELDS.get(resource_type, 'name'))
+
+def summarize_for_llm(data: Dict, question: Optional[str] = None) -> Dict:
+    """Project scan data down to what a GPT-4 prompt needs.
+
+    Every resource type keeps its count, so aggregate and cross-cloud
+    questions still see the whole inventory. Identifiers, per-field tallies
+    and a few sample records are only included for the types the question
+    refers to, or for all types when it names none. Nested provider sections, as in the
+    combined {'aws': ..., 'azure': ...} data, are summarized recursively.
+    """
+    relevant = relevant_resource_types(question)
+    return _summarize(data, relevant)
+
+def _summarize(data: Dict, relevant: Optional[set]) -> Dict:
+    summary = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            summary[key] = _summarize(value, relevant)
+        elif isinstance(value, list):
+            entry = {'count': len(value)}
+            if value and (relevant is None or key in relevant):
+                ids: List = [_resource_id(key, resource) for resource in value[:MAX_IDS]]
+                entry['ids'] = ids
+                if len(value) > MAX_IDS:
+                    entry['ids_truncated'] = True
+                for field in BREAKDOWN_FIELDS:
+                    if field in value[0]:
+                        entry[f'by_{field}'] = dict(Counter(str(resource.get(field)) for resource in value))
+                entry['sample'] = value[:SAMPLE_SIZE]
+            summary[key] = entry
+    return summary